@@ -0,0 +1,390 @@
+"""Authentication for Karyaa: password hashing, user lookups and session tokens.
+
+Passwords are hashed with salted PBKDF2-SHA256. Hashing runs in a small bounded
+thread pool so a burst of logins can't saturate the server, and accounts still
+holding a legacy unsalted SHA-256 hash are rehashed the first time they log in.
+After a successful login the app keeps a signed session token in the URL, so a
+page reload doesn't need the password to be verified again. Logging out bumps
+the user's token version, which revokes every token issued to them.
+
+Study groups are stored here too, since team membership spans user databases.
+Members of a group can see each other's weekly hours per subject and goal
+counts, so joining a group needs the invite code its creator shares.
+
+Benchmark login throughput with:
+
+    python auth.py --benchmark
+"""
+import argparse
+import base64
+import binascii
+import hashlib
+import hmac
+import os
+import queue
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+AUTH_DB = 'auth.db'
+POOL_SIZE = 4
+
+# Tuned so one hash takes roughly 100ms on a typical server core
+KDF_ALGORITHM = 'pbkdf2_sha256'
+KDF_ITERATIONS = 200_000
+KDF_WORKERS = max(2, (os.cpu_count() or 2) // 2)
+KDF_MAX_PENDING = KDF_WORKERS * 4
+KDF_WAIT_SECONDS = 5
+
+TOKEN_TTL_SECONDS = 7 * 24 * 3600
+USER_CACHE_SECONDS = 60
+
+
+class AuthBusyError(Exception):
+    """Raised when too many password checks are already queued"""
+
+
+class ConnectionPool:
+    """A fixed-size pool of SQLite connections shared between script threads"""
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self._connections = queue.Queue()
+        for _ in range(size):
+            self._connections.put(sqlite3.connect(path, check_same_thread=False))
+
+    @contextmanager
+    def connection(self):
+        conn = self._connections.get()
+        try:
+            yield conn
+        finally:
+            # Never hand back a connection mid-transaction: it would keep holding the write lock
+            if conn.in_transaction:
+                conn.rollback()
+            self._connections.put(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_kdf_executor = ThreadPoolExecutor(max_workers=KDF_WORKERS, thread_name_prefix='kdf')
+_kdf_slots = threading.BoundedSemaphore(KDF_MAX_PENDING)
+_user_cache = {}
+_user_cache_lock = threading.Lock()
+_secret_keys = {}
+
+
+def get_pool(path=AUTH_DB):
+    """Get the shared connection pool for an auth database"""
+    with _pools_lock:
+        if path not in _pools:
+            _pools[path] = ConnectionPool(path)
+        return _pools[path]
+
+
+def init_auth_db(path=AUTH_DB):
+    """Initialize the authentication database"""
+    with get_pool(path).connection() as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS users
+                     (username TEXT PRIMARY KEY,
+                      password_hash TEXT,
+                      created_at TEXT,
+                      token_version INTEGER DEFAULT 0)''')
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(users)")]
+        if 'token_version' not in columns:
+            conn.execute("ALTER TABLE users ADD COLUMN token_version INTEGER DEFAULT 0")
+        conn.execute('''CREATE TABLE IF NOT EXISTS settings
+                     (key TEXT PRIMARY KEY,
+                      value TEXT)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS teams
+                     (name TEXT PRIMARY KEY,
+                      owner TEXT,
+                      invite_code TEXT,
+                      created_at TEXT)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS team_members
+                     (team TEXT,
+                      username TEXT,
+                      joined_at TEXT,
+                      PRIMARY KEY (team, username))''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_team_members_username ON team_members (username)")
+        conn.commit()
+
+
+def hash_password_legacy(password):
+    """Hash the password using unsalted SHA-256 (only used to verify old accounts)"""
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+def hash_password(password, iterations=KDF_ITERATIONS):
+    """Hash the password with a random salt using PBKDF2-SHA256"""
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f'{KDF_ALGORITHM}${iterations}${salt.hex()}${digest.hex()}'
+
+
+def check_password(password, stored_hash):
+    """Check a password against a stored hash
+
+    Returns (matches, needs_rehash).
+    """
+    if not stored_hash:
+        return False, False
+    if not stored_hash.startswith(f'{KDF_ALGORITHM}$'):
+        matches = hmac.compare_digest(hash_password_legacy(password), stored_hash)
+        return matches, matches
+    _, iterations, salt, digest = stored_hash.split('$')
+    candidate = hashlib.pbkdf2_hmac('sha256', password.encode(), bytes.fromhex(salt), int(iterations))
+    matches = hmac.compare_digest(candidate.hex(), digest)
+    return matches, matches and int(iterations) < KDF_ITERATIONS
+
+
+_DUMMY_HASH = hash_password(secrets.token_hex(8))
+
+
+def _run_kdf(fn, *args):
+    """Run a hashing call on the KDF executor, bounding how many can be queued"""
+    if not _kdf_slots.acquire(timeout=KDF_WAIT_SECONDS):
+        raise AuthBusyError("Too many logins in progress, please try again")
+    try:
+        return _kdf_executor.submit(fn, *args).result()
+    finally:
+        _kdf_slots.release()
+
+
+def register_user(username, password, path=AUTH_DB):
+    """Register a new user"""
+    password_hash = _run_kdf(hash_password, password)
+    with get_pool(path).connection() as conn:
+        try:
+            conn.execute("""INSERT INTO users (username, password_hash, created_at)
+                            VALUES (?, ?, ?)""",
+                         (username, password_hash, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+            conn.commit()
+        except sqlite3.IntegrityError:
+            # Username already exists
+            return False
+    _forget_user(path, username)
+    return True
+
+
+def verify_user(username, password, path=AUTH_DB):
+    """Verify user credentials, upgrading legacy password hashes on success"""
+    with get_pool(path).connection() as conn:
+        row = conn.execute("SELECT password_hash FROM users WHERE username = ?", (username,)).fetchone()
+
+    # Hash something even for unknown users so response time doesn't reveal which usernames exist
+    stored_hash = row[0] if row else _DUMMY_HASH
+    matches, needs_rehash = _run_kdf(check_password, password, stored_hash)
+    if not row or not matches:
+        return False
+
+    if needs_rehash:
+        new_hash = _run_kdf(hash_password, password)
+        with get_pool(path).connection() as conn:
+            conn.execute("UPDATE users SET password_hash = ? WHERE username = ? AND password_hash = ?",
+                         (new_hash, username, stored_hash))
+            conn.commit()
+    return True
+
+
+def _secret_key(path=AUTH_DB):
+    """Get the session signing key, creating and storing one on first use"""
+    env_key = os.environ.get('KARYAA_SECRET_KEY')
+    if env_key:
+        return env_key.encode()
+    if path not in _secret_keys:
+        with get_pool(path).connection() as conn:
+            conn.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('secret_key', ?)",
+                         (secrets.token_hex(32),))
+            conn.commit()
+            _secret_keys[path] = conn.execute(
+                "SELECT value FROM settings WHERE key = 'secret_key'").fetchone()[0].encode()
+    return _secret_keys[path]
+
+
+def _sign(payload, path):
+    return hmac.new(_secret_key(path), payload.encode(), hashlib.sha256).hexdigest()
+
+
+def issue_token(username, path=AUTH_DB, ttl=TOKEN_TTL_SECONDS):
+    """Create a signed session token for a logged-in user"""
+    version = _token_version(username, path)
+    if version is None:
+        raise ValueError(f"Unknown user: {username}")
+    user = base64.urlsafe_b64encode(username.encode()).decode().rstrip('=')
+    payload = f'{user}.{version}.{int(time.time()) + ttl}'
+    return f'{payload}.{_sign(payload, path)}'
+
+
+def _token_version(username, path):
+    """Get a user's current token version (None if the user doesn't exist), cached briefly"""
+    now = time.monotonic()
+    with _user_cache_lock:
+        cached = _user_cache.get((path, username))
+        if cached and cached[1] > now:
+            return cached[0]
+    with get_pool(path).connection() as conn:
+        row = conn.execute("SELECT token_version FROM users WHERE username = ?", (username,)).fetchone()
+    version = row[0] if row else None
+    with _user_cache_lock:
+        _user_cache[(path, username)] = (version, now + USER_CACHE_SECONDS)
+    return version
+
+
+def _forget_user(path, username):
+    with _user_cache_lock:
+        _user_cache.pop((path, username), None)
+
+
+def revoke_tokens(username, path=AUTH_DB):
+    """Invalidate every session token issued to a user (called on logout)"""
+    with get_pool(path).connection() as conn:
+        conn.execute("UPDATE users SET token_version = token_version + 1 WHERE username = ?", (username,))
+        conn.commit()
+    _forget_user(path, username)
+
+
+def verify_token(token, path=AUTH_DB):
+    """Return the username for a valid session token, or None"""
+    try:
+        user, version, expires, signature = token.split('.')
+        version, expires = int(version), int(expires)
+        if expires < time.time():
+            return None
+        expected = _sign(f'{user}.{version}.{expires}', path)
+        if not hmac.compare_digest(expected.encode(), signature.encode()):
+            return None
+        username = base64.urlsafe_b64decode(user + '=' * (-len(user) % 4)).decode()
+    except (AttributeError, ValueError, binascii.Error, UnicodeError):
+        # Malformed or tampered tokens are simply not valid
+        return None
+    return username if _token_version(username, path) == version else None
+
+
+def create_team(team, owner, path=AUTH_DB):
+    """Create a study group with its creator as the first member
+
+    Returns the group's invite code, or None if the name is already taken.
+    """
+    invite_code = secrets.token_urlsafe(8)
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with get_pool(path).connection() as conn:
+        try:
+            conn.execute("INSERT INTO teams (name, owner, invite_code, created_at) VALUES (?, ?, ?, ?)",
+                         (team, owner, invite_code, now))
+        except sqlite3.IntegrityError:
+            return None
+        conn.execute("INSERT OR IGNORE INTO team_members (team, username, joined_at) VALUES (?, ?, ?)",
+                     (team, owner, now))
+        conn.commit()
+    return invite_code
+
+
+def join_team(team, username, invite_code, path=AUTH_DB):
+    """Add a user to a study group if the invite code matches"""
+    with get_pool(path).connection() as conn:
+        row = conn.execute("SELECT invite_code FROM teams WHERE name = ?", (team,)).fetchone()
+        if not row or not hmac.compare_digest(row[0].encode(), invite_code.encode()):
+            return False
+        conn.execute("INSERT OR IGNORE INTO team_members (team, username, joined_at) VALUES (?, ?, ?)",
+                     (team, username, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        conn.commit()
+    return True
+
+
+def get_invite_code(team, username, path=AUTH_DB):
+    """Get a study group's invite code, only for the group's creator"""
+    with get_pool(path).connection() as conn:
+        row = conn.execute("SELECT invite_code FROM teams WHERE name = ? AND owner = ?",
+                           (team, username)).fetchone()
+    return row[0] if row else None
+
+
+def leave_team(team, username, path=AUTH_DB):
+    """Remove a user from a study group"""
+    with get_pool(path).connection() as conn:
+        conn.execute("DELETE FROM team_members WHERE team = ? AND username = ?", (team, username))
+        conn.commit()
+
+
+def list_user_teams(username, path=AUTH_DB):
+    """List the study groups a user belongs to"""
+    with get_pool(path).connection() as conn:
+        return [row[0] for row in conn.execute(
+            "SELECT team FROM team_members WHERE username = ? ORDER BY team", (username,))]
+
+
+def list_team_members(team, path=AUTH_DB):
+    """List the members of a study group"""
+    with get_pool(path).connection() as conn:
+        return [row[0] for row in conn.execute(
+            "SELECT username FROM team_members WHERE team = ? ORDER BY username", (team,))]
+
+
+def benchmark_logins(users=50, logins=400, concurrency=16):
+    """Measure login and token verification throughput against a scratch auth database"""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'auth.db')
+        init_auth_db(path)
+        with get_pool(path).connection() as conn:
+            # Half the accounts start with legacy hashes to exercise rehash-on-login
+            conn.executemany("INSERT INTO users (username, password_hash, created_at) VALUES (?, ?, ?)",
+                             [(f'user{i}', hash_password_legacy(f'password{i}'), '') for i in range(0, users, 2)])
+            conn.commit()
+        for i in range(1, users, 2):
+            register_user(f'user{i}', f'password{i}', path)
+
+        def login(i):
+            started = time.perf_counter()
+            ok = verify_user(f'user{i % users}', f'password{i % users}', path)
+            return ok, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as clients:
+            outcomes = list(clients.map(login, range(logins)))
+        elapsed = time.perf_counter() - started
+        latencies = sorted(latency for _, latency in outcomes)
+        results['logins'] = logins
+        results['login_failures'] = sum(1 for ok, _ in outcomes if not ok)
+        results['logins_per_second'] = logins / elapsed
+        results['login_p50_ms'] = latencies[len(latencies) // 2] * 1000
+        results['login_p95_ms'] = latencies[int(len(latencies) * 0.95)] * 1000
+
+        tokens = [issue_token(f'user{i}', path) for i in range(users)]
+        started = time.perf_counter()
+        for i in range(logins * 10):
+            verify_token(tokens[i % users], path)
+        results['token_checks_per_second'] = logins * 10 / (time.perf_counter() - started)
+
+        _secret_keys.pop(path, None)
+        with _pools_lock:
+            pool = _pools.pop(path)
+        while not pool._connections.empty():
+            pool._connections.get().close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Karyaa authentication tools")
+    parser.add_argument('--benchmark', action='store_true', help="Benchmark login throughput")
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--logins', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(f"KDF: {KDF_ALGORITHM}, {KDF_ITERATIONS} iterations, {KDF_WORKERS} workers")
+        for name, value in benchmark_logins(args.users, args.logins, args.concurrency).items():
+            print(f"{name}: {value:.1f}" if isinstance(value, float) else f"{name}: {value}")
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
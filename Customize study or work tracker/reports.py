@@ -0,0 +1,254 @@
+"""Weekly summary reports for every registered user.
+
+Run from the app directory (next to auth.db and users/):
+
+    python reports.py --workers 8 --format pdf
+
+load_team_summaries() reads the same per-user summaries for a study group's
+team dashboard, fanning the reads out over a thread pool.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+from PIL import Image, ImageDraw, ImageFont
+
+AUTH_DB = 'auth.db'
+USERS_DIR = 'users'
+DONE_FILE = 'done.txt'
+
+# Colors taken from the dashboard's dark theme
+BG_COLOR = '#1a1f2c'
+TEXT_COLOR = '#ffffff'
+ACCENT_COLOR = '#63b3ed'
+SUCCESS_COLOR = '#48bb78'
+MUTED_COLOR = '#a0aec0'
+
+TEAM_WORKERS = 16
+
+REPORT_WIDTH = 900
+BAR_HEIGHT = 28
+
+
+def user_db_path(username):
+    """Get the database path for a user (same layout as get_db_path in study_tracker.py)"""
+    return os.path.join(USERS_DIR, f'{username}_study_tracker.db')
+
+
+def list_users(auth_db=AUTH_DB):
+    """List all registered usernames"""
+    conn = sqlite3.connect(auth_db)
+    usernames = [row[0] for row in conn.execute("SELECT username FROM users ORDER BY username")]
+    conn.close()
+    return usernames
+
+
+def week_bounds(day):
+    """Return the Monday and Sunday of the week containing day"""
+    start = day - timedelta(days=day.weekday())
+    return start, start + timedelta(days=6)
+
+
+def load_user_summary(username, start_date, end_date):
+    """Completed hours per subject and goal counts for one user between two dates"""
+    summary = {'hours': {}, 'goals_completed': 0, 'goals_active': 0}
+    path = user_db_path(username)
+    if not os.path.exists(path):
+        # Don't report a missing database as an empty week
+        raise FileNotFoundError(f"No database for {username} at {path}")
+
+    start, end = start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        queries = [
+            ("""SELECT subject, SUM(duration) FROM tasks
+                WHERE completed = 1 AND completion_date BETWEEN ? AND ?
+                GROUP BY subject""", (start, end)),
+            ("""SELECT r.subject, SUM(r.duration) FROM occurrence_status s
+                JOIN recurring_tasks r ON r.id = s.rule_id
+                WHERE s.status = 'completed' AND s.completion_date BETWEEN ? AND ?
+                GROUP BY r.subject""", (start, end)),
+        ]
+        for query, params in queries:
+            try:
+                for subject, hours in conn.execute(query, params):
+                    summary['hours'][subject] = summary['hours'].get(subject, 0) + (hours or 0)
+            except sqlite3.OperationalError:
+                # Databases created before recurring tasks existed lack these tables
+                pass
+
+        try:
+            completed, active = conn.execute("""
+                SELECT SUM(CASE WHEN completed = 1 AND completion_date BETWEEN ? AND ? THEN 1 ELSE 0 END),
+                       SUM(CASE WHEN completed = 0 THEN 1 ELSE 0 END)
+                FROM goals
+            """, (start, end)).fetchone()
+            summary['goals_completed'] = completed or 0
+            summary['goals_active'] = active or 0
+        except sqlite3.OperationalError:
+            pass
+    finally:
+        conn.close()
+    return summary
+
+
+def load_team_summaries(usernames, start_date, end_date, workers=TEAM_WORKERS):
+    """Load the summaries of many users in parallel
+
+    Returns (summaries, missing): summaries maps each username to their summary,
+    and missing lists members who don't have a database yet. The reads are
+    short SQLite queries that release the GIL, so threads are enough here.
+    """
+    def load(username):
+        try:
+            return username, load_user_summary(username, start_date, end_date)
+        except FileNotFoundError:
+            return username, None
+
+    with ThreadPoolExecutor(max_workers=min(workers, max(len(usernames), 1))) as pool:
+        results = list(pool.map(load, usernames))
+    summaries = {username: summary for username, summary in results if summary is not None}
+    missing = [username for username, summary in results if summary is None]
+    return summaries, missing
+
+
+def render_summary_image(username, start_date, summary):
+    """Draw the weekly summary as a bar chart of hours per subject"""
+    hours = sorted(summary['hours'].items(), key=lambda item: item[1], reverse=True)
+    height = 170 + max(len(hours), 1) * (BAR_HEIGHT + 12)
+    image = Image.new('RGB', (REPORT_WIDTH, height), BG_COLOR)
+    draw = ImageDraw.Draw(image)
+    title_font = ImageFont.load_default(size=28)
+    font = ImageFont.load_default(size=18)
+
+    total = sum(h for _, h in hours)
+    draw.text((30, 25), f"{username}'s week of {start_date.strftime('%d %b %Y')}",
+              fill=TEXT_COLOR, font=title_font)
+    draw.text((30, 70), f"Total: {total:.1f}h    Goals completed: {summary['goals_completed']}"
+                        f"    Active goals: {summary['goals_active']}",
+              fill=MUTED_COLOR, font=font)
+
+    top = 120
+    if not hours:
+        draw.text((30, top), "No completed study time this week.", fill=MUTED_COLOR, font=font)
+        return image
+
+    label_width = 220
+    max_bar = REPORT_WIDTH - label_width - 120
+    longest = max(h for _, h in hours) or 1
+    for idx, (subject, subject_hours) in enumerate(hours):
+        y = top + idx * (BAR_HEIGHT + 12)
+        draw.text((30, y + 4), str(subject)[:22], fill=TEXT_COLOR, font=font)
+        bar_end = label_width + max(int(max_bar * subject_hours / longest), 2)
+        draw.rounded_rectangle((label_width, y, bar_end, y + BAR_HEIGHT), radius=6,
+                               fill=SUCCESS_COLOR if idx == 0 else ACCENT_COLOR)
+        draw.text((bar_end + 10, y + 4), f"{subject_hours:.1f}h", fill=TEXT_COLOR, font=font)
+    return image
+
+
+def render_user_report(username, start_date, out_path, fmt):
+    """Worker: read one user's data and write their summary report"""
+    summary = load_user_summary(username, start_date, start_date + timedelta(days=6))
+    image = render_summary_image(username, start_date, summary)
+
+    # Write to a temporary file first so an interrupted run never leaves a partial report
+    tmp_path = f'{out_path}.tmp'
+    image.save(tmp_path, format='PDF' if fmt == 'pdf' else 'PNG')
+    os.replace(tmp_path, out_path)
+    return username
+
+
+def print_progress(done, total, username, started, skipped=0):
+    """Print a single progress line with throughput and ETA"""
+    elapsed = time.monotonic() - started
+    rate = (done - skipped) / elapsed if elapsed > 0 else 0
+    eta = (total - done) / rate if rate > 0 else 0
+    print(f"[{done}/{total}] {username} ({rate:.1f} reports/s, ETA {eta:.0f}s)", flush=True)
+
+
+def generate_reports(out_dir='reports', day=None, workers=None, fmt='png',
+                     auth_db=AUTH_DB, progress=print_progress):
+    """Render a weekly report for every user using a process pool
+
+    Users already listed in the week's done file are skipped, so an interrupted
+    run can be restarted and will pick up where it stopped.
+    """
+    start_date, _ = week_bounds(day or (datetime.now().date() - timedelta(days=7)))
+    week_dir = os.path.join(out_dir, start_date.strftime('%Y-%m-%d'))
+    os.makedirs(week_dir, exist_ok=True)
+
+    done_path = os.path.join(week_dir, DONE_FILE)
+    finished = set()
+    if os.path.exists(done_path):
+        with open(done_path) as f:
+            finished = {line.rstrip('\n') for line in f if line.strip()}
+
+    users = list_users(auth_db)
+    pending_users = [u for u in users if u not in finished]
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * 2
+    failed = {}
+    skipped = done = len(users) - len(pending_users)
+    started = time.monotonic()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool, open(done_path, 'a') as done_file:
+        queue = iter(pending_users)
+        in_flight = {}
+
+        def submit_next():
+            username = next(queue, None)
+            if username is None:
+                return False
+            out_path = os.path.join(week_dir, f'{username}.{fmt}')
+            in_flight[pool.submit(render_user_report, username, start_date, out_path, fmt)] = username
+            return True
+
+        # Keep only a bounded number of reports queued at any time
+        while len(in_flight) < max_in_flight and submit_next():
+            pass
+
+        while in_flight:
+            completed, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in completed:
+                username = in_flight.pop(future)
+                try:
+                    future.result()
+                    done_file.write(f'{username}\n')
+                    done_file.flush()
+                    done += 1
+                    if progress:
+                        progress(done, len(users), username, started, skipped)
+                except Exception as e:
+                    failed[username] = str(e)
+                submit_next()
+
+    return {'week': start_date, 'total': len(users), 'skipped': skipped,
+            'generated': len(pending_users) - len(failed), 'failed': failed,
+            'seconds': time.monotonic() - started}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate weekly summary reports for all users")
+    parser.add_argument('--out', default='reports', help="Output directory")
+    parser.add_argument('--week', help="Any date in the week to report on (default: last week)")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes")
+    parser.add_argument('--format', choices=['png', 'pdf'], default='png')
+    parser.add_argument('--auth-db', default=AUTH_DB)
+    args = parser.parse_args()
+
+    day = datetime.strptime(args.week, '%Y-%m-%d').date() if args.week else None
+    result = generate_reports(args.out, day, args.workers, args.format, args.auth_db)
+
+    print(f"Week of {result['week']}: {result['generated']} generated, {result['skipped']} already done, "
+          f"{len(result['failed'])} failed in {result['seconds']:.1f}s")
+    for username, error in result['failed'].items():
+        print(f"  {username}: {error}", file=sys.stderr)
+    return 1 if result['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,17 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 from datetime import datetime, timedelta
 import sqlite3
 import json
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-import hashlib
 import os
+from auth import (AuthBusyError, create_team, get_invite_code, init_auth_db, issue_token,
+                  join_team, leave_team, list_team_members, list_user_teams, register_user,
+                  revoke_tokens, verify_token, verify_user)
+from reports import load_team_summaries
 
 # Set page configuration
 st.set_page_config(
@@ -136,9 +140,13 @@ def get_db_path(username):
         os.makedirs('users')
     return f'users/{username}_study_tracker.db'
 
+def get_db_connection():
+    """Get database connection for the current user"""
+    return sqlite3.connect(get_db_path(st.session_state.username))
+
 def init_user_db(username):
     """Initialize database for a specific user"""
-    conn = sqlite3.connect('study_tracker.db')
+    conn = sqlite3.connect(get_db_path(username))
     c = conn.cursor()
     
     # Create tasks table
@@ -162,7 +170,18 @@ def init_user_db(username):
                   completed INTEGER DEFAULT 0,
                   completion_date TEXT,
                   priority TEXT,
-                  reminder_days INTEGER)''')
+                  reminder_days INTEGER,
+                  subject TEXT,
+                  task_id INTEGER,
+                  target_hours REAL DEFAULT 0,
+                  start_date TEXT)''')
+
+    # Goals created before goal linking lack the link columns
+    goal_columns = [row[1] for row in c.execute("PRAGMA table_info(goals)")]
+    for column, column_type in [('subject', 'TEXT'), ('task_id', 'INTEGER'),
+                                ('target_hours', 'REAL DEFAULT 0'), ('start_date', 'TEXT')]:
+        if column not in goal_columns:
+            c.execute(f"ALTER TABLE goals ADD COLUMN {column} {column_type}")
     
     # Create subject_progress table
     c.execute('''CREATE TABLE IF NOT EXISTS subject_progress
@@ -170,64 +189,634 @@ def init_user_db(username):
                   total_planned_hours REAL DEFAULT 0,
                   completed_hours REAL DEFAULT 0,
                   last_updated TEXT)''')
-    
+
+    # Create recurring_tasks table (one compact rule per repeating task)
+    c.execute('''CREATE TABLE IF NOT EXISTS recurring_tasks
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  subject TEXT,
+                  topic TEXT,
+                  video_link TEXT,
+                  notes TEXT,
+                  duration REAL,
+                  weekdays TEXT,
+                  start_date TEXT,
+                  end_date TEXT,
+                  template_id INTEGER)''')
+
+    # Create occurrence_status table (sparse: only completed/skipped occurrences get a row)
+    c.execute('''CREATE TABLE IF NOT EXISTS occurrence_status
+                 (rule_id INTEGER,
+                  occurrence_date TEXT,
+                  status TEXT,
+                  completion_date TEXT,
+                  PRIMARY KEY (rule_id, occurrence_date))''')
+
+    # Create weekly template tables
+    c.execute('''CREATE TABLE IF NOT EXISTS weekly_templates
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  name TEXT UNIQUE,
+                  created_at TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS template_items
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  template_id INTEGER,
+                  weekday INTEGER,
+                  subject TEXT,
+                  topic TEXT,
+                  video_link TEXT,
+                  notes TEXT,
+                  duration REAL)''')
+
+    # Create sessions table (append-only focus timer events)
+    c.execute('''CREATE TABLE IF NOT EXISTS sessions
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  task_id INTEGER,
+                  rule_id INTEGER,
+                  task_date TEXT,
+                  event TEXT,
+                  event_time TEXT)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sessions_task_date ON sessions (task_date)")
+
+    # Indexes for the goal progress join
+    c.execute("CREATE INDEX IF NOT EXISTS idx_tasks_subject_completion ON tasks (subject, completed, completion_date)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_recurring_tasks_subject ON recurring_tasks (subject)")
+
+    # Create mutation_log table (append-only history of task and goal edits, used for undo)
+    c.execute('''CREATE TABLE IF NOT EXISTS mutation_log
+                 (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                  logged_at TEXT,
+                  table_name TEXT,
+                  op TEXT,
+                  row_key TEXT,
+                  before_image TEXT,
+                  after_image TEXT,
+                  undone INTEGER DEFAULT 0)''')
+
+    # Create rollup_state table (how far each rollup has read the mutation log)
+    c.execute('''CREATE TABLE IF NOT EXISTS rollup_state
+                 (name TEXT PRIMARY KEY,
+                  last_seq INTEGER)''')
     conn.commit()
+    refresh_subject_progress(conn)
+    compact_mutation_log(conn)
+
+    conn.commit()
+    conn.close()
+
+SESSION_FLUSH_SIZE = 20
+POMODORO_MINUTES = 25
+OVERDUE_LOOKBACK_DAYS = 14
+MUTATION_LOG_KEEP = 500
+VELOCITY_WINDOW_DAYS = 28
+TEAM_CACHE_SECONDS = 60
+LEADERBOARD_ROWS = 25
+
+# Tables whose edits go through the mutation log, with their key columns
+LOGGED_TABLES = {
+    'tasks': ('id',),
+    'goals': ('id',),
+    'recurring_tasks': ('id',),
+    'occurrence_status': ('rule_id', 'occurrence_date'),
+}
+
+WEEKDAY_NAMES = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+PLANNED_COLUMNS = ['key', 'id', 'rule_id', 'date', 'subject', 'topic', 'video_link',
+                   'notes', 'duration', 'completed', 'completion_date']
+
+def week_start(day):
+    """Return the Monday of the week containing day"""
+    return day - timedelta(days=day.weekday())
+
+def iter_occurrences(rules, start_date, end_date):
+    """Yield the occurrences of recurring task rules that fall between two dates (inclusive)"""
+    for rule in rules:
+        weekdays = {int(d) for d in rule['weekdays'].split(',') if d != ''}
+        first = max(start_date, datetime.strptime(rule['start_date'], '%Y-%m-%d').date())
+        last = end_date
+        if rule['end_date']:
+            last = min(end_date, datetime.strptime(rule['end_date'], '%Y-%m-%d').date())
+        day = first
+        while day <= last:
+            if day.weekday() in weekdays:
+                date_str = day.strftime('%Y-%m-%d')
+                yield {
+                    'key': f"r{rule['id']}_{date_str}",
+                    'id': None,
+                    'rule_id': rule['id'],
+                    'date': date_str,
+                    'subject': rule['subject'],
+                    'topic': rule['topic'],
+                    'video_link': rule['video_link'],
+                    'notes': rule['notes'],
+                    'duration': rule['duration'],
+                    'completed': 0,
+                    'completion_date': None,
+                }
+            day += timedelta(days=1)
+
+def load_occurrences(conn, start_date, end_date):
+    """Expand recurring task rules into occurrences for the given date window"""
+    start, end = start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
+    rules = pd.read_sql_query("""
+        SELECT * FROM recurring_tasks
+        WHERE start_date <= ?
+        AND (end_date IS NULL OR end_date >= ?)
+    """, conn, params=(end, start))
+    occurrences = pd.DataFrame(iter_occurrences(rules.to_dict('records'), start_date, end_date),
+                               columns=PLANNED_COLUMNS)
+
+    if not occurrences.empty:
+        # Overlay the sparse completed/skipped markers onto the expanded occurrences
+        status = pd.read_sql_query("""
+            SELECT rule_id, occurrence_date AS date, status, completion_date AS status_date
+            FROM occurrence_status
+            WHERE occurrence_date BETWEEN ? AND ?
+        """, conn, params=(start, end))
+        occurrences = occurrences.merge(status, on=['rule_id', 'date'], how='left')
+        occurrences = occurrences[occurrences['status'] != 'skipped']
+        done = occurrences['status'] == 'completed'
+        occurrences['completed'] = done.astype(int)
+        occurrences['completion_date'] = occurrences['status_date'].where(done, None)
+        occurrences = occurrences[PLANNED_COLUMNS]
+    return occurrences
+
+def load_planned_tasks(conn, start_date, end_date):
+    """Load one-off tasks plus recurring occurrences expanded for the given date window"""
+    tasks = pd.read_sql_query("""
+        SELECT id, NULL AS rule_id, date, subject, topic, video_link, notes,
+               duration, completed, completion_date
+        FROM tasks
+        WHERE date BETWEEN ? AND ?
+    """, conn, params=(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
+    tasks['key'] = tasks['id'].astype(str)
+    occurrences = load_occurrences(conn, start_date, end_date)
+
+    frames = [df for df in (tasks[PLANNED_COLUMNS], occurrences) if not df.empty]
+    if not frames:
+        return pd.DataFrame(columns=PLANNED_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+def load_week_matrix(conn, start_date):
+    """Build the subject x day grid of planned and completed hours for one week"""
+    end_date = start_date + timedelta(days=6)
+
+    # One aggregated query for one-off tasks; recurring occurrences are aggregated in memory
+    totals = pd.read_sql_query("""
+        SELECT date, subject,
+               SUM(duration) AS planned_hours,
+               SUM(CASE WHEN completed = 1 THEN duration ELSE 0 END) AS completed_hours
+        FROM tasks
+        WHERE date BETWEEN ? AND ?
+        GROUP BY date, subject
+    """, conn, params=(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
+    occurrences = load_occurrences(conn, start_date, end_date)
+    if not occurrences.empty:
+        occurrence_totals = occurrences.assign(
+            planned_hours=occurrences['duration'],
+            completed_hours=occurrences['duration'] * occurrences['completed']
+        )[['date', 'subject', 'planned_hours', 'completed_hours']]
+        totals = pd.concat([df for df in (totals, occurrence_totals) if not df.empty], ignore_index=True)
+
+    days = [(start_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(7)]
+    if totals.empty:
+        empty = pd.DataFrame(columns=days, dtype=float)
+        return empty, empty.copy()
+    matrix = totals.pivot_table(index='subject', columns='date',
+                                values=['planned_hours', 'completed_hours'],
+                                aggfunc='sum', fill_value=0)
+    return (matrix['planned_hours'].reindex(columns=days, fill_value=0),
+            matrix['completed_hours'].reindex(columns=days, fill_value=0))
+
+def buffer_session_event(task, event):
+    """Queue a focus timer event in session state; the buffer is written in batches"""
+    st.session_state.session_events.append((
+        None if pd.isna(task['id']) else int(task['id']),
+        None if pd.isna(task['rule_id']) else int(task['rule_id']),
+        task['date'],
+        event,
+        datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    ))
+    if event == 'stop' or len(st.session_state.session_events) >= SESSION_FLUSH_SIZE:
+        flush_session_events()
+
+def flush_session_events():
+    """Append all buffered focus timer events to the sessions table in one transaction"""
+    events = st.session_state.get('session_events')
+    if not events:
+        return
+    conn = get_db_connection()
+    with conn:
+        conn.executemany("""INSERT INTO sessions (task_id, rule_id, task_date, event, event_time)
+                            VALUES (?, ?, ?, ?, ?)""", events)
     conn.close()
+    st.session_state.session_events = []
+
+def load_actual_hours(conn, start_date, end_date):
+    """Sum the recorded focus time per planned task between two dates"""
+    # Every start/resume event runs until the next event logged for the same task
+    return pd.read_sql_query("""
+        SELECT CASE WHEN rule_id IS NULL THEN CAST(task_id AS TEXT)
+                    ELSE 'r' || rule_id || '_' || task_date END AS key,
+               SUM((julianday(next_time) - julianday(event_time)) * 24) AS actual_hours
+        FROM (SELECT task_id, rule_id, task_date, event, event_time,
+                     LEAD(event_time) OVER (PARTITION BY task_id, rule_id, task_date
+                                            ORDER BY id) AS next_time
+              FROM sessions
+              WHERE task_date BETWEEN ? AND ?)
+        WHERE event IN ('start', 'resume')
+        AND next_time IS NOT NULL
+        GROUP BY key
+    """, conn, params=(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
+
+def ensure_subject(c, subject, today):
+    """Make sure a subject has a subject_progress row"""
+    c.execute("""INSERT OR IGNORE INTO subject_progress
+                (subject, total_planned_hours, completed_hours, last_updated)
+                VALUES (?, ?, ?, ?)""",
+             (subject, 0.0, 0.0, today))
 
-def init_auth_db():
-    """Initialize the authentication database"""
-    conn = sqlite3.connect('auth.db')
+def fetch_row(c, table, key):
+    """Fetch one row of a logged table as a dict, used for before/after images"""
+    where = ' AND '.join(f'{col} = ?' for col in key)
+    c.execute(f"SELECT * FROM {table} WHERE {where}", tuple(key.values()))
+    row = c.fetchone()
+    return dict(zip([d[0] for d in c.description], row)) if row else None
+
+def log_mutation(c, table, op, key, before, after):
+    """Append an entry to the mutation log in the caller's transaction"""
+    c.execute("""INSERT INTO mutation_log
+                (logged_at, table_name, op, row_key, before_image, after_image)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+             (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), table, op, json.dumps(key),
+              json.dumps(before) if before is not None else None,
+              json.dumps(after) if after is not None else None))
+
+def logged_insert(c, table, values):
+    """Insert a row and log it; returns the row's key"""
+    c.execute(f"INSERT INTO {table} ({', '.join(values)}) VALUES ({', '.join('?' * len(values))})",
+             tuple(values.values()))
+    key = {'id': c.lastrowid} if LOGGED_TABLES[table] == ('id',) else {col: values[col] for col in LOGGED_TABLES[table]}
+    log_mutation(c, table, 'insert', key, None, fetch_row(c, table, key))
+    return key
+
+def logged_update(c, table, op, key, changes):
+    """Update a row and log its before- and after-images"""
+    before = fetch_row(c, table, key)
+    c.execute(f"UPDATE {table} SET {', '.join(f'{col} = ?' for col in changes)} "
+              f"WHERE {' AND '.join(f'{col} = ?' for col in key)}",
+             tuple(changes.values()) + tuple(key.values()))
+    log_mutation(c, table, op, key, before, fetch_row(c, table, key))
+
+def logged_upsert(c, table, op, values):
+    """Insert or replace a row and log its before- and after-images"""
+    key = {col: values[col] for col in LOGGED_TABLES[table]}
+    before = fetch_row(c, table, key)
+    c.execute(f"INSERT OR REPLACE INTO {table} ({', '.join(values)}) VALUES ({', '.join('?' * len(values))})",
+             tuple(values.values()))
+    log_mutation(c, table, op, key, before, fetch_row(c, table, key))
+
+def logged_delete(c, table, key):
+    """Delete a row, keeping its before-image in the log; returns the deleted row"""
+    before = fetch_row(c, table, key)
+    c.execute(f"DELETE FROM {table} WHERE {' AND '.join(f'{col} = ?' for col in key)}", tuple(key.values()))
+    log_mutation(c, table, 'delete', key, before, None)
+    return before
+
+def undo_mutations(count=1):
+    """Undo the last `count` logged actions by restoring their before-images"""
+    conn = get_db_connection()
     c = conn.cursor()
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (username TEXT PRIMARY KEY,
-                  password_hash TEXT,
-                  created_at TEXT)''')
-    
+    c.execute("""SELECT seq, table_name, op, row_key, before_image
+                 FROM mutation_log
+                 WHERE undone = 0 AND op != 'undo'
+                 ORDER BY seq DESC
+                 LIMIT ?""", (count,))
+    entries = c.fetchall()
+    for seq, table, op, row_key, before_image in entries:
+        key = json.loads(row_key)
+        before = json.loads(before_image) if before_image else None
+        current = fetch_row(c, table, key)
+        if before is None:
+            c.execute(f"DELETE FROM {table} WHERE {' AND '.join(f'{col} = ?' for col in key)}",
+                     tuple(key.values()))
+        else:
+            c.execute(f"INSERT OR REPLACE INTO {table} ({', '.join(before)}) "
+                      f"VALUES ({', '.join('?' * len(before))})", tuple(before.values()))
+
+        c.execute("UPDATE mutation_log SET undone = 1 WHERE seq = ?", (seq,))
+        log_mutation(c, table, 'undo', key, current, before)
     conn.commit()
     conn.close()
+    return len(entries)
+
+def read_changes(conn, since_seq=0, tables=None):
+    """Read mutation log entries after since_seq, oldest first, as a change feed"""
+    query = "SELECT * FROM mutation_log WHERE seq > ?"
+    params = [since_seq]
+    if tables:
+        query += f" AND table_name IN ({','.join('?' * len(tables))})"
+        params += list(tables)
+    return pd.read_sql_query(query + " ORDER BY seq", conn, params=params)
+
+def change_version(conn, tables=None):
+    """Sequence number of the latest logged change; increases whenever logged data changes"""
+    query = "SELECT COALESCE(MAX(seq), 0) FROM mutation_log"
+    params = ()
+    if tables:
+        query += f" WHERE table_name IN ({','.join('?' * len(tables))})"
+        params = tuple(tables)
+    return conn.execute(query, params).fetchone()[0]
+
+def refresh_subject_progress(conn):
+    """Apply task changes logged since the last refresh to the subject_progress rollup
+
+    Each change moves a subject's planned and completed hours by the difference
+    between the row's before- and after-image, so undo entries are handled too.
+    """
+    row = conn.execute("SELECT last_seq FROM rollup_state WHERE name = 'subject_progress'").fetchone()
+    changes = read_changes(conn, row[0] if row else 0, ['tasks'])
+    if changes.empty:
+        return
 
-def hash_password(password):
-    """Hash the password using SHA-256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    deltas = {}
+    for _, change in changes.iterrows():
+        for image, sign in ((change['before_image'], -1), (change['after_image'], 1)):
+            if image is None:
+                continue
+            task = json.loads(image)
+            planned, completed = deltas.get(task['subject'], (0.0, 0.0))
+            deltas[task['subject']] = (planned + sign * task['duration'],
+                                       completed + sign * task['duration'] * (task['completed'] or 0))
 
-def register_user(username, password):
-    """Register a new user"""
-    conn = sqlite3.connect('auth.db')
+    today = datetime.now().strftime('%Y-%m-%d')
+    for subject, (planned, completed) in deltas.items():
+        ensure_subject(conn, subject, today)
+        conn.execute("""UPDATE subject_progress
+                        SET total_planned_hours = total_planned_hours + ?,
+                            completed_hours = completed_hours + ?,
+                            last_updated = ?
+                        WHERE subject = ?""", (planned, completed, today, subject))
+    conn.execute("INSERT OR REPLACE INTO rollup_state (name, last_seq) VALUES ('subject_progress', ?)",
+                 (int(changes['seq'].max()),))
+    conn.commit()
+
+def compact_mutation_log(conn, keep=MUTATION_LOG_KEEP):
+    """Drop all but the newest `keep` log entries so the log stays bounded
+
+    Entries the subject_progress rollup hasn't consumed yet are never dropped.
+    """
+    conn.execute("""DELETE FROM mutation_log
+                    WHERE seq <= MIN((SELECT MAX(seq) FROM mutation_log) - ?,
+                                     COALESCE((SELECT last_seq FROM rollup_state
+                                               WHERE name = 'subject_progress'), 0))""", (keep,))
+
+def describe_last_action(conn):
+    """Short description of the newest action that can still be undone"""
+    row = conn.execute("""SELECT table_name, op, before_image, after_image
+                          FROM mutation_log
+                          WHERE undone = 0 AND op != 'undo'
+                          ORDER BY seq DESC LIMIT 1""").fetchone()
+    if not row:
+        return None
+    table, op, before_image, after_image = row
+    image = json.loads(after_image or before_image or '{}')
+    label = image.get('topic') or image.get('description') or image.get('occurrence_date') or ''
+    kind = {'tasks': 'task', 'goals': 'goal', 'recurring_tasks': 'recurring task',
+            'occurrence_status': 'occurrence'}.get(table, table)
+    verb = {'insert': 'Added', 'complete': 'Completed', 'delete': 'Deleted'}.get(op, op)
+    return f"{verb} {kind} {label}".strip()
+
+def add_task(c, task_date, subject, topic, video_link, notes, duration):
+    """Add a one-off task; subject_progress picks it up from the mutation log"""
+    logged_insert(c, 'tasks', {
+        'date': task_date, 'subject': subject, 'topic': topic,
+        'video_link': video_link if video_link else None,
+        'notes': notes if notes else None,
+        'duration': duration, 'completed': 0, 'completion_date': None,
+    })
+
+def add_recurring_task(c, subject, topic, video_link, notes, duration, weekdays,
+                       start_date, end_date=None, template_id=None):
+    """Store a recurring task as a single rule; occurrences are expanded on demand"""
+    logged_insert(c, 'recurring_tasks', {
+        'subject': subject, 'topic': topic, 'video_link': video_link, 'notes': notes,
+        'duration': duration,
+        'weekdays': ','.join(str(d) for d in sorted(weekdays)),
+        'start_date': start_date.strftime('%Y-%m-%d'),
+        'end_date': end_date.strftime('%Y-%m-%d') if end_date else None,
+        'template_id': template_id,
+    })
+
+def end_recurring_task(rule_id):
+    """Stop a recurring task from repeating after today"""
+    conn = get_db_connection()
     c = conn.cursor()
-    
-    # Check if username already exists
-    c.execute("SELECT username FROM users WHERE username = ?", (username,))
-    if c.fetchone():
-        conn.close()
-        return False
-    
-    # Add new user
-    password_hash = hash_password(password)
-    c.execute("""INSERT INTO users (username, password_hash, created_at)
-                 VALUES (?, ?, ?)""",
-              (username, password_hash, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    
+    logged_update(c, 'recurring_tasks', 'delete', {'id': rule_id},
+                  {'end_date': (datetime.now().date() - timedelta(days=1)).strftime('%Y-%m-%d')})
     conn.commit()
     conn.close()
-    
-    # Initialize user's database
-    init_user_db(username)
-    return True
 
-def verify_user(username, password):
-    """Verify user credentials"""
-    conn = sqlite3.connect('auth.db')
+def complete_planned_task(row, completion_date):
+    """Mark a one-off task or a single recurring occurrence as complete"""
+    conn = get_db_connection()
     c = conn.cursor()
-    
-    password_hash = hash_password(password)
-    c.execute("""SELECT username FROM users 
-                 WHERE username = ? AND password_hash = ?""",
-              (username, password_hash))
-    
-    result = c.fetchone()
+    if pd.isna(row['rule_id']):
+        logged_update(c, 'tasks', 'complete', {'id': int(row['id'])},
+                      {'completed': 1, 'completion_date': completion_date})
+    else:
+        logged_upsert(c, 'occurrence_status', 'complete',
+                      {'rule_id': int(row['rule_id']), 'occurrence_date': row['date'],
+                       'status': 'completed', 'completion_date': completion_date})
+    conn.commit()
+    conn.close()
+
+def delete_planned_task(row):
+    """Delete a one-off task, or skip a single recurring occurrence"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    if pd.isna(row['rule_id']):
+        logged_delete(c, 'tasks', {'id': int(row['id'])})
+    else:
+        logged_upsert(c, 'occurrence_status', 'delete',
+                      {'rule_id': int(row['rule_id']), 'occurrence_date': row['date'],
+                       'status': 'skipped', 'completion_date': None})
+    conn.commit()
     conn.close()
-    return result is not None
+
+def add_goal(goal_type, description, deadline, priority, reminder_days,
+             subject=None, task_id=None, target_hours=0.0, start_date=None):
+    """Add a new goal, optionally linked to a subject or a single task"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    logged_insert(c, 'goals', {
+        'goal_type': goal_type, 'description': description, 'deadline': deadline,
+        'completed': 0, 'completion_date': None, 'priority': priority,
+        'reminder_days': reminder_days, 'subject': subject, 'task_id': task_id,
+        'target_hours': target_hours, 'start_date': start_date,
+    })
+    conn.commit()
+    conn.close()
+
+def complete_goal(goal_id):
+    """Mark a goal as complete"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    logged_update(c, 'goals', 'complete', {'id': goal_id},
+                  {'completed': 1, 'completion_date': datetime.now().strftime('%Y-%m-%d')})
+    conn.commit()
+    conn.close()
+
+def delete_goal(goal_id):
+    """Delete a goal"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    logged_delete(c, 'goals', {'id': goal_id})
+    conn.commit()
+    conn.close()
+
+def load_goal_progress(conn):
+    """Completed hours towards every active linked goal, in one aggregate query
+
+    Subject goals count completed one-off tasks and recurring occurrences of that
+    subject between the goal's start date and deadline; task goals count the
+    linked task once it is done.
+    """
+    return pd.read_sql_query("""
+        SELECT goal_id, SUM(hours) AS done_hours
+        FROM (
+            SELECT g.id AS goal_id, t.duration AS hours
+            FROM goals g
+            JOIN tasks t ON t.subject = g.subject AND t.completed = 1
+                        AND t.completion_date >= COALESCE(g.start_date, '')
+                        AND t.completion_date <= g.deadline
+            WHERE g.completed = 0 AND g.task_id IS NULL
+            UNION ALL
+            SELECT g.id, t.duration
+            FROM goals g
+            JOIN tasks t ON t.id = g.task_id AND t.completed = 1
+            WHERE g.completed = 0
+            UNION ALL
+            SELECT g.id, r.duration
+            FROM goals g
+            JOIN recurring_tasks r ON r.subject = g.subject
+            JOIN occurrence_status s ON s.rule_id = r.id AND s.status = 'completed'
+                                    AND s.completion_date >= COALESCE(g.start_date, '')
+                                    AND s.completion_date <= g.deadline
+            WHERE g.completed = 0 AND g.task_id IS NULL
+        )
+        GROUP BY goal_id
+    """, conn)
+
+@st.cache_data(max_entries=32)
+def load_subject_velocity(username, version, today):
+    """Rolling mean and variance of completed hours per day for every subject
+
+    Cached per change_version, so history is only re-read after tasks change.
+    """
+    conn = sqlite3.connect(get_db_path(username))
+    history = pd.read_sql_query("""
+        SELECT completion_date, subject, duration FROM tasks
+        WHERE completed = 1 AND completion_date IS NOT NULL
+        UNION ALL
+        SELECT s.completion_date, r.subject, r.duration
+        FROM occurrence_status s
+        JOIN recurring_tasks r ON r.id = s.rule_id
+        WHERE s.status = 'completed'
+    """, conn)
+    conn.close()
+    if history.empty:
+        return pd.DataFrame(columns=['subject', 'daily_mean', 'daily_var'])
+
+    # One row per day, one column per subject, with zero-hour days filled in
+    daily = history.pivot_table(index='completion_date', columns='subject', values='duration',
+                                aggfunc='sum', fill_value=0)
+    daily.index = pd.to_datetime(daily.index)
+    days = pd.date_range(end=pd.Timestamp(today), periods=VELOCITY_WINDOW_DAYS)
+    daily = daily.reindex(daily.index.union(days), fill_value=0)
+
+    rolling = daily.rolling(VELOCITY_WINDOW_DAYS, min_periods=1)
+    return pd.DataFrame({
+        'daily_mean': rolling.mean().loc[pd.Timestamp(today)],
+        'daily_var': rolling.var().loc[pd.Timestamp(today)].fillna(0),
+    }).rename_axis('subject').reset_index()
+
+def forecast_goals(goals, velocity, today):
+    """Projected completion date and at-risk flag for every linked goal at once
+
+    A goal is at risk when, one standard deviation below the recent pace, its
+    remaining hours wouldn't be done by the deadline.
+    """
+    goals = goals.merge(velocity, left_on='forecast_subject', right_on='subject',
+                        how='left', suffixes=('', '_velocity'))
+    remaining = (goals['target'].astype(float) - goals['done_hours']).clip(lower=0).to_numpy()
+    mean = goals['daily_mean'].astype(float).fillna(0).to_numpy()
+    std = np.sqrt(goals['daily_var'].astype(float).fillna(0).to_numpy())
+    days_left = ((goals['deadline'] - pd.Timestamp(today)).dt.days + 1).clip(lower=0).to_numpy()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_needed = np.where(remaining > 0, np.ceil(remaining / mean), 0)
+    projected = pd.Series(pd.Timestamp(today) + pd.to_timedelta(
+        np.where(np.isfinite(days_needed), days_needed, np.nan), unit='D'), index=goals.index)
+    pessimistic = mean * days_left - std * np.sqrt(days_left)
+
+    goals['projected_date'] = projected.where(goals['target'] > 0)
+    goals['at_risk'] = (goals['target'] > 0) & (remaining > 0) & (pessimistic < remaining)
+    return goals.drop(columns=['subject_velocity'], errors='ignore')
+
+@st.cache_data(ttl=TEAM_CACHE_SECONDS)
+def load_team_leaderboard(team, start_date):
+    """Hours per member per subject and goal counts for a study group's week
+
+    Members' databases are read in parallel and the merged result is cached
+    briefly, so the page doesn't reopen every member's file on each rerun.
+    """
+    summaries, missing = load_team_summaries(list_team_members(team), start_date,
+                                             start_date + timedelta(days=6))
+    hours = pd.DataFrame([(member, subject, subject_hours)
+                          for member, summary in summaries.items()
+                          for subject, subject_hours in summary['hours'].items()],
+                         columns=['member', 'subject', 'hours'])
+    goals = pd.DataFrame([(member, summary['goals_completed'], summary['goals_active'])
+                          for member, summary in summaries.items()],
+                         columns=['member', 'goals_completed', 'goals_active'])
+    return hours, goals, missing
+
+def leave_study_group(team):
+    """Leave a study group and drop the cached leaderboard so it updates at once"""
+    leave_team(team, st.session_state.username)
+    load_team_leaderboard.clear()
+
+def save_week_as_template(name, start_date):
+    """Save the tasks planned for the week starting at start_date as a reusable template"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    week_tasks = load_planned_tasks(conn, start_date, start_date + timedelta(days=6))
+    c.execute("INSERT INTO weekly_templates (name, created_at) VALUES (?, ?)",
+             (name, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    template_id = c.lastrowid
+    c.executemany("""INSERT INTO template_items
+                    (template_id, weekday, subject, topic, video_link, notes, duration)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                 [(template_id, datetime.strptime(row['date'], '%Y-%m-%d').weekday(),
+                   row['subject'], row['topic'], row['video_link'], row['notes'], float(row['duration']))
+                  for row in week_tasks.to_dict('records')])
+    conn.commit()
+    conn.close()
+    return len(week_tasks)
+
+def apply_template(template_id, start_date, weeks):
+    """Apply a weekly template for a number of weeks as one recurring rule per template item"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("""SELECT weekday, subject, topic, video_link, notes, duration
+                 FROM template_items WHERE template_id = ?""", (template_id,))
+    items = c.fetchall()
+    end_date = start_date + timedelta(days=7 * weeks - 1)
+    for weekday, subject, topic, video_link, notes, duration in items:
+        add_recurring_task(c, subject, topic, video_link, notes, duration, [weekday],
+                           start_date, end_date, template_id)
+    conn.commit()
+    conn.close()
+    return len(items)
 
 # Initialize authentication database
 init_auth_db()
@@ -237,6 +826,19 @@ if 'authenticated' not in st.session_state:
     st.session_state.authenticated = False
 if 'username' not in st.session_state:
     st.session_state.username = None
+if 'session_events' not in st.session_state:
+    st.session_state.session_events = []
+if 'timer' not in st.session_state:
+    st.session_state.timer = None
+
+# Restore the login from a signed session token so page reloads skip the password check
+if not st.session_state.authenticated and 'session' in st.query_params:
+    token_user = verify_token(st.query_params['session'])
+    if token_user:
+        st.session_state.authenticated = True
+        st.session_state.username = token_user
+    else:
+        del st.query_params['session']
 
 # Login/Register form
 if not st.session_state.authenticated:
@@ -252,12 +854,16 @@ if not st.session_state.authenticated:
             submitted = st.form_submit_button("Login")
             
             if submitted:
-                if verify_user(username, password):
-                    st.session_state.authenticated = True
-                    st.session_state.username = username
-                    st.rerun()
-                else:
-                    st.error("Invalid username or password")
+                try:
+                    if verify_user(username, password):
+                        st.session_state.authenticated = True
+                        st.session_state.username = username
+                        st.query_params['session'] = issue_token(username)
+                        st.rerun()
+                    else:
+                        st.error("Invalid username or password")
+                except AuthBusyError as e:
+                    st.error(str(e))
     
     with tab2:
         with st.form("register_form"):
@@ -272,21 +878,23 @@ if not st.session_state.authenticated:
                     st.error("Passwords do not match")
                 elif len(new_password) < 6:
                     st.error("Password must be at least 6 characters long")
-                elif register_user(new_username, new_password):
-                    st.success("Registration successful! Please login.")
                 else:
-                    st.error("Username already exists")
+                    try:
+                        if register_user(new_username, new_password):
+                            # Initialize user's database
+                            init_user_db(new_username)
+                            st.success("Registration successful! Please login.")
+                        else:
+                            st.error("Username already exists")
+                    except AuthBusyError as e:
+                        st.error(str(e))
 
 else:
     # Main application code
-    def get_db_connection():
-        """Get database connection for the current user"""
-        return sqlite3.connect(get_db_path(st.session_state.username))
-
     def check_notifications():
         """Check for tasks and goals that need attention"""
         try:
-            conn = sqlite3.connect('study_tracker.db')
+            conn = get_db_connection()
             
             # Check for upcoming deadlines (next 3 days)
             upcoming_goals = pd.read_sql_query("""
@@ -297,21 +905,18 @@ else:
                 ORDER BY deadline
             """, conn)
             
-            # Check for overdue tasks
-            overdue_tasks = pd.read_sql_query("""
-                SELECT * FROM tasks 
-                WHERE completed = 0 
-                AND date(date) < date('now')
-                ORDER BY date
-            """, conn)
+            # Check for overdue tasks; missed recurring occurrences only count for a limited look-back
+            today = datetime.now().date()
+            overdue_count = conn.execute("""SELECT COUNT(*) FROM tasks
+                                            WHERE completed = 0 AND date < ?""",
+                                         (today.strftime('%Y-%m-%d'),)).fetchone()[0]
+            missed = load_occurrences(conn, today - timedelta(days=OVERDUE_LOOKBACK_DAYS),
+                                      today - timedelta(days=1))
+            overdue_count += int((missed['completed'] == 0).sum())
             
             # Check daily study targets
-            today_hours = pd.read_sql_query("""
-                SELECT subject, SUM(duration) as hours
-                FROM tasks 
-                WHERE date = date('now')
-                GROUP BY subject
-            """, conn)
+            today_hours = load_planned_tasks(conn, today, today).groupby(
+                'subject', as_index=False).agg(hours=('duration', 'sum'))
             
             conn.close()
             
@@ -326,8 +931,8 @@ else:
                     notifications.append(("⚠️", f"Goal due in {days_left} days: {goal['description']}"))
             
             # Task notifications
-            if not overdue_tasks.empty:
-                notifications.append(("📝", f"You have {len(overdue_tasks)} overdue tasks!"))
+            if overdue_count:
+                notifications.append(("📝", f"You have {overdue_count} overdue tasks!"))
             
             # Study target notifications
             subject_targets = {}
@@ -352,8 +957,15 @@ else:
 
     # Logout button in sidebar
     if st.sidebar.button("Logout"):
+        # Close any open timer so it can't carry over to the next login
+        if st.session_state.timer is not None:
+            buffer_session_event(st.session_state.timer['task'], 'stop')
+            st.session_state.timer = None
+        flush_session_events()
+        revoke_tokens(st.session_state.username)
         st.session_state.authenticated = False
         st.session_state.username = None
+        st.query_params.clear()
         st.rerun()
 
     # Display notifications
@@ -364,8 +976,19 @@ else:
             for icon, msg in notifications:
                 st.warning(f"{icon} {msg}")
 
+    # Undo recent actions
+    conn = get_db_connection()
+    last_action = describe_last_action(conn)
+    conn.close()
+    if last_action:
+        with st.sidebar:
+            st.markdown("### ↩️ Undo")
+            st.caption(f"Last action: {last_action}")
+            undo_count = st.number_input("Actions to undo", min_value=1, max_value=MUTATION_LOG_KEEP, value=1)
+            st.button("↩️ Undo", on_click=undo_mutations, args=(int(undo_count),))
+
     # Sidebar with navigation
-    page = st.sidebar.selectbox("Navigate to", ["Daily Planner", "Weekly Planner", "Goals"])
+    page = st.sidebar.selectbox("Navigate to", ["Daily Planner", "Weekly Planner", "Goals", "Team"])
 
     # Weekly motivational quote
     quotes = [
@@ -382,7 +1005,7 @@ else:
         st.header("📅 Daily Planner")
         
         # Ensure tasks table exists
-        conn = sqlite3.connect('study_tracker.db')
+        conn = get_db_connection()
         c = conn.cursor()
         c.execute('''CREATE TABLE IF NOT EXISTS tasks
                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -406,9 +1029,9 @@ else:
             col1, col2 = st.columns(2)
             with col1:
                 # Get existing subjects
-                conn = sqlite3.connect('study_tracker.db')
+                conn = get_db_connection()
                 c = conn.cursor()
-                c.execute("SELECT DISTINCT subject FROM tasks")
+                c.execute("SELECT subject FROM tasks UNION SELECT subject FROM recurring_tasks")
                 subjects = [row[0] for row in c.fetchall()]
                 conn.close()
                 
@@ -427,7 +1050,7 @@ else:
             
             submitted = st.form_submit_button("Add Task")
             if submitted:
-                conn = sqlite3.connect('study_tracker.db')
+                conn = get_db_connection()
                 c = conn.cursor()
                 
                 # If it's a new subject, add it to subject_progress
@@ -443,20 +1066,7 @@ else:
                         pass
                 
                 # Add the task
-                c.execute("""INSERT INTO tasks 
-                            (date, subject, topic, video_link, notes, duration, completed, completion_date)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-                         (today, subject, topic, 
-                          video_link if video_link else None,
-                          notes if notes else None,
-                          duration, 0, None))
-                
-                # Update subject progress
-                c.execute("""UPDATE subject_progress 
-                            SET total_planned_hours = total_planned_hours + ?,
-                                last_updated = ?
-                            WHERE subject = ?""",
-                         (duration, today, subject))
+                add_task(c, today, subject, topic, video_link, notes, duration)
                 
                 conn.commit()
                 conn.close()
@@ -466,24 +1076,27 @@ else:
         # Display today's tasks
         st.subheader("Today's Tasks")
         
-        # Get today's tasks
-        conn = sqlite3.connect('study_tracker.db')
-        today_tasks = pd.read_sql_query("""
-            SELECT * FROM tasks 
-            WHERE date = ?
-            ORDER BY completed, subject
-        """, conn, params=(today,))
-        
-        # Get daily progress
-        daily_progress = pd.read_sql_query("""
-            SELECT subject, 
-                   SUM(duration) as total_hours,
-                   SUM(CASE WHEN completed = 1 THEN duration ELSE 0 END) as completed_hours
-            FROM tasks 
-            WHERE date = ?
-            GROUP BY subject
-        """, conn, params=(today,))
+        # Get today's tasks, including today's recurring occurrences
+        conn = get_db_connection()
+        today_tasks = load_planned_tasks(conn, datetime.now().date(), datetime.now().date())
+        conn.close()
+        today_tasks = today_tasks.sort_values(['completed', 'subject'])
+
+        # Get actual focus time recorded against today's tasks
+        conn = get_db_connection()
+        actual_hours = load_actual_hours(conn, datetime.now().date(), datetime.now().date())
         conn.close()
+        today_tasks = today_tasks.merge(actual_hours, on='key', how='left')
+        today_tasks['actual_hours'] = today_tasks['actual_hours'].astype(float).fillna(0)
+
+        # Get daily progress
+        daily_progress = today_tasks.assign(
+            completed_hours=today_tasks['duration'].where(today_tasks['completed'] == 1, 0)
+        ).groupby('subject', as_index=False).agg(
+            total_hours=('duration', 'sum'),
+            completed_hours=('completed_hours', 'sum'),
+            actual_hours=('actual_hours', 'sum')
+        )
 
         # Display daily progress
         if not daily_progress.empty:
@@ -495,7 +1108,13 @@ else:
             progress_percentage = (completed_hours / total_hours * 100) if total_hours > 0 else 0
             
             # Display overall progress
-            st.metric("Overall Progress", f"{completed_hours:.1f}/{total_hours:.1f} hours")
+            actual_total = daily_progress['actual_hours'].sum()
+            col1, col2 = st.columns(2)
+            with col1:
+                st.metric("Overall Progress", f"{completed_hours:.1f}/{total_hours:.1f} hours")
+            with col2:
+                st.metric("Actual Focus Time", f"{actual_total:.1f}/{total_hours:.1f} hours",
+                          delta=f"{actual_total - total_hours:+.1f}h vs plan", delta_color="off")
             st.progress(progress_percentage / 100)
             
             # Display progress by subject
@@ -503,9 +1122,67 @@ else:
             for idx, (_, row) in enumerate(daily_progress.iterrows()):
                 with cols[idx]:
                     subject_progress = (row['completed_hours'] / row['total_hours'] * 100) if row['total_hours'] > 0 else 0
-                    st.metric(row['subject'], f"{row['completed_hours']:.1f}/{row['total_hours']:.1f}h")
+                    st.metric(row['subject'], f"{row['completed_hours']:.1f}/{row['total_hours']:.1f}h",
+                              delta=f"{row['actual_hours']:.1f}h actual", delta_color="off")
                     st.progress(subject_progress / 100)
 
+        # Focus timer
+        if not today_tasks.empty:
+            st.subheader("⏱️ Focus Timer")
+            timer = st.session_state.timer
+            pending = today_tasks[today_tasks['completed'] == 0]
+            task_labels = {row['key']: f"{row['subject']} - {row['topic']}" for _, row in today_tasks.iterrows()}
+
+            col1, col2 = st.columns(2)
+            with col1:
+                if timer is None:
+                    timer_key = st.selectbox("Task", pending['key'].tolist(), format_func=task_labels.get)
+                else:
+                    st.write(f"**Task:** {task_labels.get(timer['key'], 'Unknown task')}")
+                mode = st.radio("Mode", ["Stopwatch", f"Pomodoro ({POMODORO_MINUTES} min)"], horizontal=True)
+            with col2:
+                elapsed = 0
+                if timer is not None:
+                    elapsed = timer['elapsed']
+                    if timer['running_since']:
+                        elapsed += (datetime.now() - timer['running_since']).total_seconds()
+                if mode == "Stopwatch":
+                    st.metric("Elapsed", f"{int(elapsed // 3600):02d}:{int(elapsed % 3600 // 60):02d}:{int(elapsed % 60):02d}")
+                else:
+                    remaining = max(POMODORO_MINUTES * 60 - elapsed, 0)
+                    st.metric("Remaining", f"{int(remaining // 60):02d}:{int(remaining % 60):02d}")
+                    if timer is not None and remaining == 0:
+                        st.success("Pomodoro complete! Stop the timer and take a break.")
+
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                if timer is None:
+                    if st.button("▶️ Start", key="timer_start", disabled=pending.empty):
+                        task = today_tasks[today_tasks['key'] == timer_key].iloc[0]
+                        buffer_session_event(task, 'start')
+                        st.session_state.timer = {'key': timer_key, 'task': task,
+                                                  'running_since': datetime.now(), 'elapsed': 0}
+                        st.rerun()
+                elif timer['running_since']:
+                    if st.button("⏸️ Pause", key="timer_pause"):
+                        buffer_session_event(timer['task'], 'pause')
+                        timer['elapsed'] += (datetime.now() - timer['running_since']).total_seconds()
+                        timer['running_since'] = None
+                        st.rerun()
+                else:
+                    if st.button("▶️ Resume", key="timer_resume"):
+                        buffer_session_event(timer['task'], 'resume')
+                        timer['running_since'] = datetime.now()
+                        st.rerun()
+            with col2:
+                if timer is not None and st.button("⏹️ Stop", key="timer_stop"):
+                    buffer_session_event(timer['task'], 'stop')
+                    st.session_state.timer = None
+                    st.rerun()
+            with col3:
+                if timer is not None and st.button("🔄 Refresh", key="timer_refresh"):
+                    st.rerun()
+
         # Display tasks
         if not today_tasks.empty:
             # Group tasks by subject
@@ -517,6 +1194,8 @@ else:
                     col1, col2, col3, col4 = st.columns([3, 1, 1, 1])
                     with col1:
                         st.write(f"**Topic:** {row['topic']}")
+                        if not pd.isna(row['rule_id']):
+                            st.caption("🔁 Recurring")
                         if row['notes']:
                             st.write(f"**Notes:** {row['notes']}")
                         if row['video_link']:
@@ -525,35 +1204,13 @@ else:
                         st.write(f"**Duration:** {row['duration']}h")
                     with col3:
                         if not row['completed']:
-                            if st.button(f"✅", key=f"complete_daily_{row['id']}", help="Mark as Complete"):
-                                conn = sqlite3.connect('study_tracker.db')
-                                c = conn.cursor()
-                                c.execute("""UPDATE tasks 
-                                           SET completed = 1, completion_date = ? 
-                                           WHERE id = ?""",
-                                        (today, row['id']))
-                                conn.commit()
-                                conn.close()
-                                st.rerun()
+                            st.button(f"✅", key=f"complete_daily_{row['key']}", help="Mark as Complete",
+                                      on_click=complete_planned_task, args=(row, today))
                         else:
                             st.write("✅ Done")
                     with col4:
-                        if st.button(f"🗑️", key=f"delete_daily_{row['id']}", help="Delete Task"):
-                            conn = sqlite3.connect('study_tracker.db')
-                            c = conn.cursor()
-                            
-                            # First, update the subject progress by subtracting the hours if task was completed
-                            if row['completed']:
-                                c.execute("""UPDATE subject_progress 
-                                           SET completed_hours = completed_hours - ?
-                                           WHERE subject = ?""",
-                                        (row['duration'], row['subject']))
-                            
-                            # Then delete the task
-                            c.execute("DELETE FROM tasks WHERE id = ?", (row['id'],))
-                            conn.commit()
-                            conn.close()
-                            st.rerun()
+                        st.button(f"🗑️", key=f"delete_daily_{row['key']}", help="Delete Task",
+                                  on_click=delete_planned_task, args=(row,))
                     st.markdown("---")
         else:
             st.info("No tasks planned for today. Add some tasks to get started!")
@@ -567,7 +1224,7 @@ else:
             col1, col2 = st.columns(2)
             with col1:
                 # Get existing subjects
-                conn = sqlite3.connect('study_tracker.db')
+                conn = get_db_connection()
                 c = conn.cursor()
                 
                 # Create subject_progress table if it doesn't exist
@@ -578,7 +1235,7 @@ else:
                              last_updated TEXT)''')
                 
                 # Get existing subjects
-                c.execute("SELECT DISTINCT subject FROM tasks")
+                c.execute("SELECT subject FROM tasks UNION SELECT subject FROM recurring_tasks")
                 subjects = [row[0] for row in c.fetchall()]
                 conn.close()
                 
@@ -592,41 +1249,29 @@ else:
                 topic = st.text_input("Topic")
                 duration = st.number_input("Duration (hours)", min_value=0.5, max_value=5.0, step=0.5)
             with col2:
+                task_date = st.date_input("Date", value=datetime.now().date())
+                repeat_days = st.multiselect("Repeat on (optional)", WEEKDAY_NAMES)
+                repeat_until = st.date_input("Repeat until (optional)", value=None)
                 video_link = st.text_input("Video/Resource Link (optional)")
                 notes = st.text_area("Notes (optional)", height=100)
             
             submitted = st.form_submit_button("Add Task")
             if submitted:
-                conn = sqlite3.connect('study_tracker.db')
+                conn = get_db_connection()
                 c = conn.cursor()
-                
-                # If it's a new subject, add it to subject_progress
-                if new_subject and new_subject not in subject_options:
-                    try:
-                        c.execute("""INSERT INTO subject_progress 
-                                    (subject, total_planned_hours, completed_hours, last_updated)
-                                    VALUES (?, ?, ?, ?)""",
-                                 (new_subject, 0.0, 0.0, datetime.now().strftime('%Y-%m-%d')))
-                        conn.commit()
-                    except sqlite3.IntegrityError:
-                        # Subject already exists, ignore
-                        pass
-                
-                # Add the task
-                c.execute("""INSERT INTO tasks 
-                            (date, subject, topic, video_link, notes, duration, completed, completion_date)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-                         (datetime.now().strftime('%Y-%m-%d'), subject, topic, 
-                          video_link if video_link else None,
-                          notes if notes else None,
-                          duration, 0, None))
-                
-                # Update subject progress
-                c.execute("""UPDATE subject_progress 
-                            SET total_planned_hours = total_planned_hours + ?,
-                                last_updated = ?
-                            WHERE subject = ?""",
-                         (duration, datetime.now().strftime('%Y-%m-%d'), subject))
+                ensure_subject(c, subject, datetime.now().strftime('%Y-%m-%d'))
+
+                if repeat_days:
+                    # Recurring tasks are stored as a single rule and expanded when viewed
+                    add_recurring_task(c, subject, topic,
+                                       video_link if video_link else None,
+                                       notes if notes else None,
+                                       duration,
+                                       [WEEKDAY_NAMES.index(day) for day in repeat_days],
+                                       task_date, repeat_until)
+                else:
+                    # Add the task
+                    add_task(c, task_date.strftime('%Y-%m-%d'), subject, topic, video_link, notes, duration)
                 
                 conn.commit()
                 conn.close()
@@ -637,51 +1282,90 @@ else:
         st.subheader("This Week's Tasks")
         
         # Get all subjects for filter
-        conn = sqlite3.connect('study_tracker.db')
+        conn = get_db_connection()
         c = conn.cursor()
-        c.execute("SELECT DISTINCT subject FROM tasks")
+        c.execute("SELECT subject FROM tasks UNION SELECT subject FROM recurring_tasks")
         all_subjects = [row[0] for row in c.fetchall()]
         conn.close()
         
-        col1, col2 = st.columns(2)
+        col1, col2, col3 = st.columns(3)
         with col1:
             filter_subject = st.multiselect("Filter by Subject/Work", 
                 all_subjects if all_subjects else [],
                 default=all_subjects if all_subjects else [])
         with col2:
             show_completed = st.checkbox("Show Completed Tasks", value=True)
+        with col3:
+            start_of_week = week_start(st.date_input("Week of", value=datetime.now().date()))
+        end_of_week = start_of_week + timedelta(days=6)
         
-        # Construct the query based on filters
-        query = """
-            SELECT id, date, subject, topic, video_link, notes, duration, completed, completion_date
-            FROM tasks 
-            WHERE date >= date('now', '-7 days')
-            AND subject IN ({})
-            {}
-            ORDER BY date DESC, subject
-        """.format(
-            ','.join(['?']*len(filter_subject)) if filter_subject else "''",
-            "" if show_completed else "AND completed = 0"
-        )
-        
-        conn = sqlite3.connect('study_tracker.db')
-        tasks_df = pd.read_sql_query(query, conn, params=filter_subject if filter_subject else [])
+        # Subject x day grid built from one aggregated query and a pivot
+        conn = get_db_connection()
+        planned_matrix, completed_matrix = load_week_matrix(conn, start_of_week)
         conn.close()
+        planned_matrix = planned_matrix[planned_matrix.index.isin(filter_subject)]
+        completed_matrix = completed_matrix.reindex(planned_matrix.index)
+        week_days = list(planned_matrix.columns)
+        day_labels = [datetime.strptime(day, '%Y-%m-%d').strftime('%a %d %b') for day in week_days]
+
+        if not planned_matrix.empty:
+            ratio = (completed_matrix / planned_matrix.where(planned_matrix > 0)).fillna(0)
+            cell_text = (completed_matrix.map(lambda h: f"{h:.1f}") + "/" +
+                         planned_matrix.map(lambda h: f"{h:.1f}h")).where(planned_matrix > 0, "")
+
+            fig = go.Figure(go.Heatmap(
+                z=ratio.values,
+                x=day_labels,
+                y=list(planned_matrix.index),
+                text=cell_text.values,
+                texttemplate="%{text}",
+                colorscale="Greens",
+                zmin=0,
+                zmax=1,
+                colorbar={'title': 'Done'},
+                hovertemplate="%{y} on %{x}<br>%{text}<extra></extra>"
+            ))
+            fig.update_layout(
+                height=max(250, 60 * len(planned_matrix) + 100),
+                margin=dict(t=30, b=30),
+                yaxis={'autorange': 'reversed'}
+            )
+            st.plotly_chart(fig, use_container_width=True)
+
+            # Drill into a single cell of the grid
+            col1, col2 = st.columns(2)
+            today_str = datetime.now().strftime('%Y-%m-%d')
+            with col1:
+                selected_day = st.selectbox("Day", week_days,
+                    index=week_days.index(today_str) if today_str in week_days else 0,
+                    format_func=lambda day: day_labels[week_days.index(day)])
+            with col2:
+                selected_subject = st.selectbox("Subject/Work", ["All"] + list(planned_matrix.index))
+
+            selected_date = datetime.strptime(selected_day, '%Y-%m-%d').date()
+            conn = get_db_connection()
+            tasks_df = load_planned_tasks(conn, selected_date, selected_date)
+            conn.close()
+            tasks_df = tasks_df[tasks_df['subject'].isin(filter_subject)]
+            if selected_subject != "All":
+                tasks_df = tasks_df[tasks_df['subject'] == selected_subject]
+            if not show_completed:
+                tasks_df = tasks_df[tasks_df['completed'] == 0]
+            tasks_df = tasks_df.sort_values(['completed', 'subject'])
+        else:
+            tasks_df = pd.DataFrame(columns=PLANNED_COLUMNS)
 
         if not tasks_df.empty:
-            # Format the dataframe for display
-            display_df = tasks_df.copy()
-            display_df['date'] = pd.to_datetime(display_df['date']).dt.strftime('%Y-%m-%d')
-            display_df['status'] = display_df['completed'].map({0: '⏳ Pending', 1: '✅ Completed'})
-            
             # Allow marking tasks as complete
-            for idx, row in display_df.iterrows():
+            for idx, row in tasks_df.iterrows():
                 col1, col2, col3, col4, col5 = st.columns([2, 3, 1, 1, 1])
                 with col1:
                     st.write(f"**Date:** {row['date']}")
                     st.write(f"**Subject:** {row['subject']}")
                 with col2:
                     st.write(f"**Topic:** {row['topic']}")
+                    if not pd.isna(row['rule_id']):
+                        st.caption("🔁 Recurring")
                     if row['notes']:
                         st.write(f"**Notes:** {row['notes']}")
                 with col3:
@@ -690,57 +1374,71 @@ else:
                         st.markdown(f"[📺 Resource]({row['video_link']})")
                 with col4:
                     if not row['completed']:
-                        if st.button(f"✅", key=f"complete_{row['id']}", help="Mark as Complete"):
-                            conn = sqlite3.connect('study_tracker.db')
-                            c = conn.cursor()
-                            c.execute("""UPDATE tasks 
-                                       SET completed = 1, completion_date = ? 
-                                       WHERE id = ?""",
-                                    (datetime.now().strftime('%Y-%m-%d'), row['id']))
-                            conn.commit()
-                            conn.close()
-                            st.rerun()
+                        st.button(f"✅", key=f"complete_{row['key']}", help="Mark as Complete",
+                                  on_click=complete_planned_task, args=(row, datetime.now().strftime('%Y-%m-%d')))
                     else:
                         st.write("✅ Done")
                 with col5:
-                    if st.button(f"🗑️", key=f"delete_{row['id']}", help="Delete Task"):
-                        conn = sqlite3.connect('study_tracker.db')
-                        c = conn.cursor()
-                        
-                        # First, update the subject progress by subtracting the hours if task was completed
-                        if row['completed']:
-                            c.execute("""UPDATE subject_progress 
-                                       SET completed_hours = completed_hours - ?
-                                       WHERE subject = ?""",
-                                    (row['duration'], row['subject']))
-                        
-                        # Then delete the task
-                        c.execute("DELETE FROM tasks WHERE id = ?", (row['id'],))
-                        conn.commit()
-                        conn.close()
-                        st.rerun()
+                    st.button(f"🗑️", key=f"delete_{row['key']}", help="Delete Task",
+                              on_click=delete_planned_task, args=(row,))
                 st.markdown("---")
         else:
             st.info("No tasks found for the selected filters.")
 
+        # Weekly templates and recurring rules
+        with st.expander("🗂️ Weekly Templates & Recurring Tasks"):
+            conn = get_db_connection()
+            templates = pd.read_sql_query("SELECT id, name FROM weekly_templates ORDER BY name", conn)
+            rules = pd.read_sql_query("""
+                SELECT id, subject, topic, duration, weekdays, start_date, end_date
+                FROM recurring_tasks
+                WHERE end_date IS NULL OR end_date >= date('now')
+                ORDER BY subject
+            """, conn)
+            conn.close()
+
+            col1, col2 = st.columns(2)
+            with col1:
+                with st.form("save_template"):
+                    st.write("**Save this week as a template**")
+                    template_name = st.text_input("Template name")
+                    if st.form_submit_button("Save Template") and template_name:
+                        try:
+                            saved = save_week_as_template(template_name, start_of_week)
+                            st.success(f"Saved {saved} tasks to '{template_name}'")
+                        except sqlite3.IntegrityError:
+                            st.error("A template with that name already exists")
+            with col2:
+                with st.form("apply_template"):
+                    st.write("**Apply a template**")
+                    template_id = st.selectbox("Template", templates['id'].tolist(),
+                        format_func=lambda tid: templates.loc[templates['id'] == tid, 'name'].iloc[0])
+                    weeks = st.number_input("Number of weeks", min_value=1, max_value=52, value=1)
+                    if st.form_submit_button("Apply from selected week") and template_id is not None:
+                        apply_template(int(template_id), start_of_week, int(weeks))
+                        st.rerun()
+
+            for _, rule in rules.iterrows():
+                col1, col2 = st.columns([4, 1])
+                with col1:
+                    days = ', '.join(WEEKDAY_NAMES[int(d)] for d in rule['weekdays'].split(','))
+                    until = f" until {rule['end_date']}" if rule['end_date'] else ""
+                    st.write(f"🔁 **{rule['subject']}** - {rule['topic']} ({rule['duration']}h) on {days} from {rule['start_date']}{until}")
+                with col2:
+                    st.button("End", key=f"end_rule_{rule['id']}", help="Stop repeating from today",
+                              on_click=end_recurring_task, args=(int(rule['id']),))
+
     elif page == "Goals":
         st.header("🎯 Goals")
         
-        # Ensure goals table exists
-        conn = sqlite3.connect('study_tracker.db')
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS goals
-                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                     goal_type TEXT,
-                     description TEXT,
-                     deadline TEXT,
-                     completed INTEGER DEFAULT 0,
-                     completion_date TEXT,
-                     priority TEXT,
-                     reminder_days INTEGER)''')
-        conn.commit()
+        # Subjects and open tasks a goal can be linked to
+        conn = get_db_connection()
+        subject_options = [row[0] for row in conn.execute(
+            "SELECT subject FROM tasks UNION SELECT subject FROM recurring_tasks ORDER BY subject")]
+        open_tasks = conn.execute("""SELECT id, topic FROM tasks
+                                     WHERE completed = 0 ORDER BY date""").fetchall()
         conn.close()
-        
+
         # Add new goal with more options
         with st.form("new_goal"):
             st.subheader("Set New Goal")
@@ -752,29 +1450,32 @@ else:
             with col2:
                 deadline = st.date_input("Deadline", min_value=datetime.now().date())
                 reminder_days = st.number_input("Remind me before (days)", min_value=1, max_value=14, value=3)
+                link = st.selectbox("Track progress from", ["Nothing"] + [f"Subject: {s}" for s in subject_options]
+                                    + [f"Task #{tid}: {topic}" for tid, topic in open_tasks])
+                target_hours = st.number_input("Target hours (0 = task duration)", min_value=0.0, step=0.5)
                 
             submitted = st.form_submit_button("Add Goal")
             if submitted:
-                conn = sqlite3.connect('study_tracker.db')
-                c = conn.cursor()
-                c.execute("""INSERT INTO goals 
-                            (goal_type, description, deadline, completed, completion_date, priority, reminder_days)
-                            VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                         (goal_type, description, deadline.strftime('%Y-%m-%d'), 0, None, priority, reminder_days))
-                conn.commit()
-                conn.close()
+                linked_subject = link[len("Subject: "):] if link.startswith("Subject: ") else None
+                linked_task = int(link[len("Task #"):].split(':')[0]) if link.startswith("Task #") else None
+                add_goal(goal_type, description, deadline.strftime('%Y-%m-%d'), priority, reminder_days,
+                         linked_subject, linked_task, target_hours, datetime.now().strftime('%Y-%m-%d'))
                 st.success("Goal added successfully!")
                 st.rerun()
 
         # Display active goals with timeline
         st.subheader("📋 Active Goals Timeline")
         
-        conn = sqlite3.connect('study_tracker.db')
+        conn = get_db_connection()
         goals_df = pd.read_sql_query("""
-            SELECT * FROM goals 
-            WHERE completed = 0
-            ORDER BY deadline
+            SELECT g.*, t.duration AS task_duration, COALESCE(g.subject, t.subject) AS forecast_subject
+            FROM goals g
+            LEFT JOIN tasks t ON t.id = g.task_id
+            WHERE g.completed = 0
+            ORDER BY g.deadline
         """, conn)
+        goal_progress = load_goal_progress(conn)
+        forecast_version = change_version(conn, ['tasks', 'occurrence_status', 'recurring_tasks'])
         
         # Display completed goals
         completed_goals = pd.read_sql_query("""
@@ -787,7 +1488,18 @@ else:
         if not goals_df.empty:
             # Create timeline visualization
             goals_df['deadline'] = pd.to_datetime(goals_df['deadline'])
-            goals_df['start_date'] = datetime.now().date()
+
+            # Progress towards linked goals; task goals default to the task's duration
+            goals_df = goals_df.merge(goal_progress, left_on='id', right_on='goal_id', how='left')
+            goals_df['done_hours'] = goals_df['done_hours'].astype(float).fillna(0)
+            goals_df['target'] = goals_df['target_hours'].fillna(0).where(
+                goals_df['target_hours'].fillna(0) > 0, goals_df['task_duration']).astype(float)
+            goals_df['percent'] = (goals_df['done_hours'] / goals_df['target'] * 100).clip(upper=100)
+
+            # Forecast completion from recent pace, recomputed only when the mutation log moves
+            today_date = datetime.now().date()
+            velocity = load_subject_velocity(st.session_state.username, forecast_version, today_date)
+            goals_df = forecast_goals(goals_df, velocity, today_date)
             
             fig = go.Figure()
             
@@ -832,6 +1544,21 @@ else:
                     with col1:
                         st.write(f"**{row['goal_type']} Goal:** {row['description']}")
                         st.write(f"**Priority:** {row['priority']}")
+                        if pd.notna(row['subject']) or pd.notna(row['task_id']):
+                            linked = row['subject'] if pd.notna(row['subject']) else f"task #{int(row['task_id'])}"
+                            if pd.isna(row['target']) or row['target'] <= 0:
+                                st.write(f"**Progress ({linked}):** {row['done_hours']:.1f}h")
+                            else:
+                                st.progress(row['percent'] / 100,
+                                            text=f"{linked}: {row['done_hours']:.1f}/{row['target']:.1f}h ({row['percent']:.0f}%)")
+                                if row['done_hours'] >= row['target']:
+                                    st.success("🎉 Target reached")
+                                elif pd.isna(row['projected_date']):
+                                    st.warning("⚠️ At risk: no recent progress on this subject")
+                                elif row['at_risk']:
+                                    st.warning(f"⚠️ At risk: projected {row['projected_date'].strftime('%Y-%m-%d')}")
+                                else:
+                                    st.info(f"📈 Projected {row['projected_date'].strftime('%Y-%m-%d')}")
                     with col2:
                         st.write(f"**Deadline:** {deadline.strftime('%Y-%m-%d')}")
                         if days_left < 0:
@@ -841,16 +1568,8 @@ else:
                         else:
                             st.info(f"{days_left} days left")
                     with col3:
-                        if st.button(f"Complete", key=f"complete_goal_{row['id']}"):
-                            conn = sqlite3.connect('study_tracker.db')
-                            c = conn.cursor()
-                            c.execute("""UPDATE goals 
-                                       SET completed = 1, completion_date = ? 
-                                       WHERE id = ?""",
-                                    (datetime.now().strftime('%Y-%m-%d'), row['id']))
-                            conn.commit()
-                            conn.close()
-                            st.rerun()
+                        st.button(f"Complete", key=f"complete_goal_{row['id']}",
+                                  on_click=complete_goal, args=(int(row['id']),))
                     st.markdown("---")
         else:
             st.info("No active goals. Add a new goal to get started!")
@@ -864,13 +1583,92 @@ else:
                         st.write(f"**{row['goal_type']} Goal:** {row['description']}")
                         st.write(f"**Completed on:** {row['completion_date']}")
                     with col2:
-                        if st.button(f"🗑️", key=f"delete_goal_{row['id']}", help="Delete Goal"):
-                            conn = sqlite3.connect('study_tracker.db')
-                            c = conn.cursor()
-                            c.execute("DELETE FROM goals WHERE id = ?", (row['id'],))
-                            conn.commit()
-                            conn.close()
-                            st.rerun()
+                        st.button(f"🗑️", key=f"delete_goal_{row['id']}", help="Delete Goal",
+                                  on_click=delete_goal, args=(int(row['id']),))
                     st.markdown("---")
             else:
-                st.info("No completed goals yet.") 
\ No newline at end of file
+                st.info("No completed goals yet.") 
+
+    elif page == "Team":
+        st.header("👥 Team")
+
+        st.caption("Everyone in a study group can see each member's weekly hours per subject and goal counts.")
+
+        # Start a new study group, or join one with its invite code
+        col1, col2 = st.columns(2)
+        with col1:
+            with st.form("create_team"):
+                st.write("**Create a study group**")
+                new_team = st.text_input("Group name")
+                if st.form_submit_button("Create") and new_team.strip():
+                    if create_team(new_team.strip(), st.session_state.username):
+                        load_team_leaderboard.clear()
+                        st.success(f"Created '{new_team.strip()}'")
+                        st.rerun()
+                    else:
+                        st.error("A study group with that name already exists")
+        with col2:
+            with st.form("join_team"):
+                st.write("**Join a study group**")
+                team_name = st.text_input("Group name", key="join_team_name")
+                invite_code = st.text_input("Invite code", type="password")
+                if st.form_submit_button("Join") and team_name.strip():
+                    if join_team(team_name.strip(), st.session_state.username, invite_code.strip()):
+                        load_team_leaderboard.clear()
+                        st.success(f"Joined '{team_name.strip()}'")
+                        st.rerun()
+                    else:
+                        st.error("Unknown group or wrong invite code")
+
+        teams = list_user_teams(st.session_state.username)
+        if teams:
+            col1, col2 = st.columns(2)
+            with col1:
+                team = st.selectbox("Study group", teams)
+            with col2:
+                start_of_week = week_start(st.date_input("Week of", value=datetime.now().date(), key="team_week"))
+
+            hours, goals, missing = load_team_leaderboard(team, start_of_week)
+
+            # Leaderboard: total hours this week, with each member's subjects and goals
+            leaderboard = goals.set_index('member')
+            subject_hours = hours.pivot_table(index='member', columns='subject', values='hours',
+                                              aggfunc='sum', fill_value=0)
+            leaderboard = leaderboard.join(subject_hours).fillna(0)
+            leaderboard.insert(0, 'total_hours', subject_hours.sum(axis=1).reindex(leaderboard.index).fillna(0))
+            leaderboard = leaderboard.sort_values(['total_hours', 'goals_completed'], ascending=False)
+
+            st.subheader(f"🏆 Week of {start_of_week.strftime('%d %b %Y')}")
+            if not hours.empty:
+                fig = px.bar(hours, x='member', y='hours', color='subject',
+                             category_orders={'member': leaderboard.index.tolist()},
+                             labels={'member': 'Member', 'hours': 'Hours', 'subject': 'Subject'})
+                fig.update_layout(height=400, margin=dict(t=30, b=30))
+                st.plotly_chart(fig, use_container_width=True)
+            else:
+                st.info("No completed study time in this group this week.")
+
+            medals = ['🥇', '🥈', '🥉']
+            for rank, (member, row) in enumerate(leaderboard.head(LEADERBOARD_ROWS).iterrows()):
+                col1, col2, col3 = st.columns([3, 1, 1])
+                with col1:
+                    st.write(f"{medals[rank] if rank < len(medals) else f'#{rank + 1}'} **{member}**")
+                    subjects = row.drop(['total_hours', 'goals_completed', 'goals_active'])
+                    subjects = subjects[subjects > 0].sort_values(ascending=False)
+                    if not subjects.empty:
+                        st.caption(', '.join(f"{subject}: {subject_hours:.1f}h" for subject, subject_hours in subjects.items()))
+                with col2:
+                    st.write(f"**{row['total_hours']:.1f}h**")
+                with col3:
+                    st.write(f"🎯 {int(row['goals_completed'])} goals")
+            if len(leaderboard) > LEADERBOARD_ROWS:
+                st.caption(f"...and {len(leaderboard) - LEADERBOARD_ROWS} more members")
+            if missing:
+                st.caption(f"No data yet for: {', '.join(missing)}")
+
+            invite = get_invite_code(team, st.session_state.username)
+            if invite:
+                st.caption(f"Invite code for {team} (share it only with members): `{invite}`")
+            st.button(f"Leave {team}", on_click=leave_study_group, args=(team,))
+        else:
+            st.info("You're not in a study group yet. Create one, or ask a group's creator for its invite code!")